@@ -4,7 +4,6 @@ __version__ = '2.7.12'
 __author__ = 'Robin Betz'
 
 import sys
-import inspect
 
 #=========================================================================
 
@@ -31,7 +30,7 @@ class DabbleError(Exception):
         try:
             ln = sys.exc_info()[-1].tb_lineno
         except AttributeError:
-            ln = inspect.currentframe().f_back.f_lineno
+            ln = sys._getframe(1).f_lineno # pylint: disable=protected-access
 
         print("\n\n\n{0.__name__} (line {1}): {2}\n".format(type(self), ln, msg))
 
@@ -176,7 +176,8 @@ class DabbleBuilder(object):
         print("Centering solvent...")
         self.molids['tiled_membrane'] = \
                 molutils.center_system(molid=self.molids['tiled_membrane'],
-                                       tmp_dir=self.tmp_dir, center_z=True)
+                                       tmp_dir=self.tmp_dir, center_z=True,
+                                       force_reload=True)
 
         # Combine tiled membrane with solute
         print("Combining solute and tiled solvent patch...")
@@ -585,7 +586,8 @@ class DabbleBuilder(object):
             atomsel(molid=self.molids['wtmp']).moveby((0, 0, move))
             self.molids['wats_up'] = molutils.center_system(molid=self.molids['wtmp'],
                                                             tmp_dir=self.tmp_dir,
-                                                            center_z=False)
+                                                            center_z=False,
+                                                            force_reload=True)
             self.remove_molecule('wtmp')
             to_combine.append(self.molids['wats_up'])
 
@@ -603,7 +605,8 @@ class DabbleBuilder(object):
             atomsel(molid=self.molids['wtmp']).moveby((0, 0, move))
             self.molids['wats_down'] = molutils.center_system(molid=self.molids['wtmp'],
                                                               tmp_dir=self.tmp_dir,
-                                                              center_z=False)
+                                                              center_z=False,
+                                                              force_reload=True)
             self.remove_molecule('wtmp')
             to_combine.append(self.molids['wats_down'])
 
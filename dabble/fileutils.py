@@ -104,15 +104,31 @@ def concatenate_mae_files(output_filename,
         raise ValueError("Need at least one input filename")
 
     outfile = open(output_filename, 'w')
-    for line in open(input_filenames[0]):
-        outfile.write(line)
+    append_mae_file(outfile, input_filenames[0], header=True)
     for input_filename in input_filenames[1:]:
-        infile = open(input_filename)
-        for _ in range(5):
-            infile.readline()
+        append_mae_file(outfile, input_filename)
+    outfile.close()
+
+#==========================================================================
+
+def append_mae_file(outfile, input_filename, header=False):
+    """
+    Appends the contents of a mae file to an open output file, so that
+    a combined file can be built up one molecule at a time.
+
+    Args:
+      outfile (file): Open file to write to
+      input_filename (str): Input mae file to append
+      header (bool): Whether to copy the file header too. Should only be
+        True for the first file written to outfile
+    """
+
+    with open(input_filename) as infile:
+        if not header:
+            for _ in range(5):
+                infile.readline()
         for line in infile:
             outfile.write(line)
-    outfile.close()
 
 #==========================================================================
 
@@ -23,17 +23,26 @@ the VMD python API.
 from __future__ import print_function
 import os
 import tempfile
+from functools import lru_cache
 import numpy as np
 from vmd import molecule, atomsel
 
 from dabble import DabbleError
-from dabble.fileutils import concatenate_mae_files
+from dabble.fileutils import append_mae_file, concatenate_mae_files
 # pylint: disable=no-member
 
 #++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
 # Constants
 __1M_SALT_IONS_PER_WATER = 0.018
+__ION_RESNAMES = dict(Na='SOD', K='POT', Cl='CLA')
+__ION_NAMES = dict(Na='NA', K='K', Cl='CL')
+__ION_CHARGES = dict(Na=1, K=1, Cl=-1)
+
+# Shared memory directory for scratch files, and a generous estimate of
+# the size of one atom's entry in a mae file
+__SHM_DIR = '/dev/shm'
+__MAE_BYTES_PER_ATOM = 256
 
 #==============================================================================
 
@@ -53,20 +62,38 @@ def get_net_charge(sel, molid):
       ValueError: If charge does not round to an integer value
     """
 
-    charge = np.array(atomsel(sel, molid=molid).charge)
+    return _net_charge(np.array(atomsel(sel, molid=molid).charge), sel)
+
+#==========================================================================
+
+def _net_charge(charge, sel):
+    """
+    Gets the net charge of a set of atomic charges that have already
+    been fetched from a selection.
+
+    Args:
+      charge (numpy array): Charge of each atom
+      sel (str): VMD atom selection the charges came from, for messages
+
+    Returns:
+      (int): The rounded net charge
+
+    Throws:
+      DabbleError: If charge does not round to an integer value
+    """
+
     if charge.size == 0:
         return 0
     print("Calculating charge on %d atoms" % charge.size)
 
     # Check the system has charges defined
-    if all(charge == 0):
+    if not charge.any():
         print("\nWARNING: All charges in selection are zero. "
               "Check the input file has formal charges defined!\n"
               "Selection was:\n%s\n"%sel)
-        print(set(charge))
 
     # Round to nearest integer nd check this is okay
-    net_charge = sum(charge)
+    net_charge = float(charge.sum(dtype=np.float64))
     rslt = round(net_charge)
     if abs(rslt - net_charge) > 0.05:
         raise DabbleError("Total charge of %f is not integral within a "
@@ -94,6 +121,40 @@ def get_system_net_charge(molid):
 
 #==========================================================================
 
+def _convex_hull(coords):
+    """
+    Finds the convex hull of a set of xy coordinates using Andrew's
+    monotone chain algorithm.
+
+    Args:
+      coords (numpy array Nx2) : XY coordinates to get hull of
+
+    Returns:
+      (list of int): Indices of coords that are vertices of the hull
+    """
+    xy = np.asarray(coords, dtype=np.float64)
+    order = np.lexsort((xy[:, 1], xy[:, 0])).tolist()
+    pts = xy.tolist()
+
+    def half_hull(indices):
+        chain = []
+        for k in indices:
+            px, py = pts[k]
+            while len(chain) >= 2:
+                ox, oy = pts[chain[-2]]
+                ax, ay = pts[chain[-1]]
+                if (ax-ox)*(py-oy) - (ay-oy)*(px-ox) > 0:
+                    break
+                chain.pop()
+            chain.append(k)
+        return chain
+
+    lower = half_hull(order)
+    upper = half_hull(reversed(order))
+    return lower[:-1] + upper[:-1]
+
+#==========================================================================
+
 def diameter(coords, chunkmem=30e6):
     """
     Returns the diameter of a set of xy coordinates.
@@ -109,15 +170,41 @@ def diameter(coords, chunkmem=30e6):
     coords = np.require(coords, dtype=np.float32)
     if coords.size == 0:
         return 0
-    nper = int(chunkmem / (4*coords.size))
-    D = np.array([np.inner(x, x) for x in coords])
+
+    # The farthest pair of points always lies on the convex hull, so
+    # only hull vertices need to be compared in the plane
+    if coords.ndim == 2 and coords.shape[1] == 2 and len(coords) > 3:
+        hull = _convex_hull(coords)
+        if len(hull) >= 2:
+            coords = coords[hull]
+
+    nper = min(len(coords), max(1, int(chunkmem / (4*coords.size))))
+
+    # The expansion below loses precision to cancellation when points are
+    # far from the origin relative to their spread, so center them first.
+    # Coordinates are kept in float32, but products are accumulated in
+    # float64 against a transposed copy upcast once, up front.
+    coords = np.require(coords - coords.mean(axis=0, dtype=np.float64),
+                        dtype=np.float32)
+
+    # Squared distance is |a|^2 + |b|^2 - 2a.b = -2(a.b - |a|^2/2 - |b|^2/2),
+    # so take the minimum of the bracketed term and scale only that, rather
+    # than scaling the coordinates or the products by -2
+    H = 0.5 * np.einsum('ij,ij->i', coords, coords, dtype=np.float64)
+    coords_T = np.ascontiguousarray(coords.T, dtype=np.float64)
+
+    # Each chunk of distances is accumulated in place in a single
+    # preallocated buffer. Only the small chunk of coordinates is upcast
+    # per iteration.
+    buf = np.empty((nper, len(coords)), dtype=np.float64)
     i = 0
     d = 0
     while i < len(coords):
-        M = np.inner(-2*coords, coords[i:i+nper])
-        M += D[i:i+nper]
-        M += D[:, None]
-        nd = M.max()
+        M = buf[:len(coords[i:i+nper])]
+        np.dot(coords[i:i+nper].astype(np.float64), coords_T, out=M)
+        M -= H
+        M -= H[i:i+nper, None]
+        nd = -2.0 * M.min()
         if nd > d:
             d = nd
         i += nper
@@ -169,48 +256,44 @@ def get_num_salt_ions_needed(molid,
     """
     # pylint: disable = too-many-branches, too-many-locals
 
-    cations = atomsel_remaining(molid, 'element %s' % cation)
-    anions = atomsel_remaining(molid, 'element %s' % anion)
+    # Get charges of both ion types in one selection and split them here
+    ions = atomsel_remaining(molid, 'element %s %s' % (cation, anion))
+    charge = np.array(ions.charge)
+    is_cation = np.array(ions.element) == cation
+    num_cations = int(is_cation.sum())
+    num_anions = len(ions) - num_cations
     molid = molecule.get_top()
     try:
-        abs(get_net_charge(str(cations), molid)-len(cations)) > 0.01
+        abs(_net_charge(charge[is_cation], 'element %s' % cation)
+            - num_cations) > 0.01
     except ValueError:
         # Check for bonded cations
-        # Minimize the number of calls to atomsel
-        nonbonded_cation_index = [cations.index[i] \
-                                  for i in range(len(cations)) \
-                                  if len(cations.bonds[i]) == 0]
-
-        if not nonbonded_cation_index:
-            cations = atomsel('none')
-        else:
-            cations = atomsel_remaining(molid,
-                                        'index '+' '.join(nonbonded_cation_index))
+        cations = _nonbonded_atoms(atomsel_remaining(molid,
+                                                     'element %s' % cation),
+                                   molid)
+        num_cations = len(cations)
 
-        if abs(get_net_charge(str(cations), molid)-len(cations)) < 0.01:
+        if abs(get_net_charge(str(cations), molid)-num_cations) < 0.01:
             raise Exception('Num cations and net cation charge are not equal')
     try:
-        abs(get_net_charge(str(anions), molid)+len(anions)) > 0.01
+        abs(_net_charge(charge[~is_cation], 'element %s' % anion)
+            + num_anions) > 0.01
     except ValueError:
         # Check for bonded anions
-        nonbonded_anion_index = [anions.index[i] \
-                                 for i in range(len(anions)) \
-                                 if len(anions.bonds[i]) == 0]
-        if not nonbonded_anion_index:
-            anions = atomsel('none')
-        else:
-            anions = atomsel_remaining(molid,
-                                       'index '+' '.join(nonbonded_anion_index))
-        if abs(get_net_charge(str(anions), molid)+len(anions)) < 0.01:
+        anions = _nonbonded_atoms(atomsel_remaining(molid,
+                                                    'element %s' % anion),
+                                  molid)
+        num_anions = len(anions)
+        if abs(get_net_charge(str(anions), molid)+num_anions) < 0.01:
             raise Exception('num anions and abs anion charge are not equal')
 
     num_waters = num_atoms_remaining(molid, water_sel)
     num_for_conc = int(round(__1M_SALT_IONS_PER_WATER * num_waters * conc))
-    pos_ions_needed = num_for_conc - len(cations)
-    neg_ions_needed = num_for_conc - len(anions)
+    pos_ions_needed = num_for_conc - num_cations
+    neg_ions_needed = num_for_conc - num_anions
     system_charge = get_system_net_charge(molid)
 
-    new_system_charge = system_charge + len(anions) - len(cations)
+    new_system_charge = system_charge + num_anions - num_cations
     to_neutralize = abs(new_system_charge)
     if new_system_charge > 0:
         if to_neutralize > pos_ions_needed:
@@ -228,8 +311,8 @@ def get_num_salt_ions_needed(molid,
     pos_ions_needed = max(0, pos_ions_needed)
     neg_ions_needed = max(0, neg_ions_needed)
 
-    total_cations = len(cations) + pos_ions_needed
-    total_anions = len(anions) + neg_ions_needed
+    total_cations = num_cations + pos_ions_needed
+    total_anions = num_anions + neg_ions_needed
 
     # volume estimate from prev waters
     cation_conc = (float(total_cations) / num_waters) / __1M_SALT_IONS_PER_WATER
@@ -246,6 +329,54 @@ def get_num_salt_ions_needed(molid,
 
 #==========================================================================
 
+def _nonbonded_atoms(sel, molid):
+    """
+    Selects the remaining atoms of a selection that have no bonds.
+    Bonds and indices are each fetched from VMD once, in bulk.
+
+    Args:
+      sel (atomsel): VMD atom selection to filter
+      molid (int): VMD molecule ID to select within
+
+    Returns:
+      VMD atomsel object with the nonbonded atoms of the selection
+    """
+    bonds = sel.bonds
+    indices = np.array(sel.index, dtype=int)
+    nonbonded = np.fromiter((not b for b in bonds),
+                            dtype=bool, count=len(bonds))
+
+    if not nonbonded.any():
+        return atomsel('none')
+    return atomsel_remaining(molid, _index_selstr(indices[nonbonded]))
+
+#==========================================================================
+
+def _index_selstr(indices):
+    """
+    Builds a compact VMD atom selection string for a set of atom indices,
+    writing runs of consecutive indices as ranges.
+
+    Args:
+      indices (list of int): Atom indices to select
+
+    Returns:
+      (str) VMD atom selection string for those indices
+    """
+    indices = np.unique(np.asarray(indices, dtype=int))
+    if indices.size == 0:
+        return 'none'
+
+    # Split into runs of consecutive indices
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = indices[np.concatenate(([0], breaks))]
+    ends = indices[np.concatenate((breaks - 1, [indices.size - 1]))]
+
+    return 'index ' + ' '.join('%d to %d' % (lo, hi) if hi > lo else '%d' % lo
+                               for lo, hi in zip(starts, ends))
+
+#==========================================================================
+
 def lipid_composition(lipid_sel, molid):
     """
     Calculates the lipid composition of each leaflet of the membrane
@@ -264,12 +395,16 @@ def lipid_composition(lipid_sel, molid):
         """
         selstr = "not element H C and (%s) and (%s)" % (lipid_sel, leaflet_sel)
         sel = atomsel_remaining(molid, selstr)
-        resnames = set(sel.resname)
+        names, resname_ids = np.unique(np.array(sel.resname),
+                                       return_inverse=True)
+
+        # Each unique (resname, fragment) pair is one lipid of that kind
+        pairs = np.unique(np.stack((resname_ids.ravel(),
+                                    np.array(sel.fragment, dtype=int))),
+                          axis=1)
+        counts = np.bincount(pairs[0], minlength=len(names))
 
-        dct = {s : len(set(atomsel_remaining(molid,
-                                             "%s and resname '%s'"
-                                             % (sel, s)).fragment))
-               for s in resnames}
+        dct = {str(s) : int(n) for s, n in zip(names, counts)}
         return dct
 
     inner, outer = leaflet('z < 0'), leaflet('not (z < 0)')
@@ -324,34 +459,42 @@ def get_system_dimensions(molid):
 
 #==========================================================================
 
-def center_system(molid, tmp_dir, center_z=False):
+def center_system(molid, tmp_dir, center_z=False, force_reload=False):
     """
     Centers an entire system in the XY-plane, and optionally in the Z
-    dimension. Needs to save and reload the file in case the current
-    positions need to be concatenated to produce a new file.
+    dimension. The centered positions are only in memory unless a reload
+    is forced, which saves and reloads the file so the current positions
+    can be concatenated to produce a new file.
 
     Args:
       molid (int): VMD molecule id to center
       tmp_dir (str): Directory to create temp file in
       center_z (bool): Whether or not to center along the Z axis as well
+      force_reload (bool): Whether to save and reload the centered system
+        as a new molecule, deleting the input one
 
     Returns:
       (int) : VMD molecule id of centered system
     """
     # pylint: disable=invalid-name
-    x, y, z = atomsel('all', molid=molid).center()
+    allsel = atomsel('all', molid=molid)
+    x, y, z = allsel.center()
 
     if center_z is True:
-        atomsel('all', molid=molid).moveby((-x, -y, -z))
+        allsel.moveby((-x, -y, -z))
     else:
-        atomsel('all', molid=molid).moveby((-x, -y, 0))
+        allsel.moveby((-x, -y, 0))
+
+    if not force_reload:
+        return molid
 
     # Save and reload the solute to record atom positions
     temp_mae = tempfile.mkstemp(suffix='.mae',
                                 prefix='dabble_centered',
                                 dir=tmp_dir)[1]
-    atomsel('all', molid=molid).write('mae', temp_mae)
+    allsel.write('mae', temp_mae)
     molecule.delete(molid)
+    _cached_atomsel.cache_clear()
     new_id = molecule.load('mae', temp_mae)
     return new_id
 
@@ -374,17 +517,27 @@ def set_ion(molid, atom_id, element):
     if not sel:
         raise ValueError("Index %d does not exist" % atom_id)
 
-    resname = dict(Na='SOD', K='POT', Cl='CLA')[element]
-    name = dict(Na='NA', K='K', Cl='CL')[element]
-    attype = dict(Na='NA', K='K', Cl='CL')[element]
-    charge = dict(Na=1, K=1, Cl=-1)[element]
+    _set_ion_attributes(sel, element)
+
+#==========================================================================
+
+def _set_ion_attributes(sel, element):
+    """
+    Sets every atom in a selection to be the desired ion, assigning
+    each attribute to the whole selection at once.
+
+    Args:
+      sel (atomsel): VMD atom selection to change to ion
+      element (str in Na, K, Cl): Ion to apply
+    """
+
     sel.element = element
-    sel.name = name
-    sel.type = attype
-    sel.resname = resname
+    sel.name = __ION_NAMES[element]
+    sel.type = __ION_NAMES[element]
+    sel.resname = __ION_RESNAMES[element]
     sel.chain = 'N'
     sel.segid = 'ION'
-    sel.charge = charge
+    sel.charge = __ION_CHARGES[element]
 
 #==========================================================================
 
@@ -405,8 +558,34 @@ def set_cations(molid, element, filter_sel='none'):
         raise DabbleError("Invalid cation '%s'. "
                           "Supported cations are Na, K" % element)
 
-    for gid in tuple(atomsel('element K Na and not (%s)' % filter_sel)):
-        set_ion(molid, gid, element)
+    sel = atomsel('element K Na and not (%s)' % filter_sel, molid=molid)
+    if sel:
+        _set_ion_attributes(sel, element)
+
+#==========================================================================
+
+def _scratch_dir(tmp_dir, nbytes):
+    """
+    Picks a directory for a short-lived scratch file. Uses shared memory
+    when it has room to spare, so files that are written and read right
+    back never touch possibly slow disk or network storage.
+
+    Args:
+      tmp_dir (str): Directory for temporary files to fall back to
+      nbytes (int): Estimated size of the file to write
+
+    Returns:
+      (str) Directory in which to put the scratch file
+    """
+    try:
+        stat = os.statvfs(__SHM_DIR)
+    except (AttributeError, OSError):
+        return tmp_dir
+
+    if stat.f_bavail * stat.f_frsize > 2 * nbytes \
+       and os.access(__SHM_DIR, os.W_OK):
+        return __SHM_DIR
+    return tmp_dir
 
 #==========================================================================
 
@@ -427,49 +606,58 @@ def tile_system(input_id, times_x, times_y, times_z, tmp_dir):
     """
     # pylint: disable=invalid-name, too-many-locals
     # Read in the equilibrated bilayer file
-    new_resid = np.array(atomsel('all', molid=input_id).residue)
-    num_residues = new_resid.max()
-    atomsel('all', molid=input_id).user = 2.0
+    allsel = atomsel('all', molid=input_id)
+    residues = np.array(allsel.residue)
+    num_residues = residues.max()
+    allsel.user = 2.0
     wx, wy, wz = get_system_dimensions(molid=input_id)
 
-    # Move the lipids over, save that file, move them back, repeat, then
-    # stack all of those together to make a tiled membrane. Uses
-    # temporary mae files to save each "tile" since this
-    # format is easy to combine. Renumbers residues as it goes along.
-    tile_filenames = []
-    for nx in range(times_x):
-        for ny in range(times_y):
-            for nz in range(times_z):
-                tx = np.array([nx * wx, ny * wy, nz * wz])
-                atomsel('all', input_id).moveby(tuple(tx))
-                atomsel('all', input_id).resid = [int(_) for _ in new_resid]
-                new_resid += num_residues
-                tile_filename = tempfile.mkstemp(suffix='.mae',
-                                                 prefix='dabble_tile_tmp',
-                                                 dir=tmp_dir)[1]
-                tile_filenames.append(tile_filename)
-                atomsel('all', molid=input_id).write('mae', tile_filename)
-                atomsel('all', molid=input_id).moveby(tuple(-tx))
-
-    # Write all of these tiles together into one large bilayer
-    merge_output_filename = tempfile.mkstemp(suffix='.mae',
-                                             prefix='dabble_merge_tile_tmp',
-                                             dir=tmp_dir)[1]
-    concatenate_mae_files(merge_output_filename,
-                          input_filenames=tile_filenames)
+    # Offset of every tile, in the same x, y, z nesting order as the tiles
+    # are written
+    offsets = np.mgrid[:times_x, :times_y, :times_z].reshape(3, -1).T \
+              * np.array([wx, wy, wz])
+
+    # Move the lipids to each tile in turn, save that tile, and append
+    # each tile to one large bilayer file as it is written since the mae
+    # format is easy to combine. Each move is only the step from the
+    # previous tile. A single temporary file is reused for every tile.
+    # Renumbers residues as it goes along.
+    # The tile file may be in shared memory, so always remove it
+    tile_fd, tile_filename = tempfile.mkstemp(suffix='.mae',
+                                              prefix='dabble_tile_tmp',
+                                              dir=_scratch_dir(
+                                                  tmp_dir,
+                                                  __MAE_BYTES_PER_ATOM
+                                                  * len(allsel)))
+    os.close(tile_fd)
+    try:
+        merge_fd, merge_output_filename = \
+                tempfile.mkstemp(suffix='.mae',
+                                 prefix='dabble_merge_tile_tmp',
+                                 dir=tmp_dir)
+        os.close(merge_fd)
+        position = np.zeros(3)
+        with open(merge_output_filename, 'w') as merged:
+            for tile, offset in enumerate(offsets):
+                allsel.moveby(tuple(offset - position))
+                position = offset
+                allsel.resid = (residues + tile * num_residues).tolist()
+                allsel.write('mae', tile_filename)
+                append_mae_file(merged, tile_filename, header=not tile)
+        allsel.moveby(tuple(-position))
+    finally:
+        os.remove(tile_filename)
 
     # Read that large bilayer file in as a new molecule and
     # write it as the output file
     output_id = molecule.load('mae', merge_output_filename)
+    _cached_atomsel.cache_clear()
     molecule.set_periodic(output_id, -1,
                           times_x * wx, times_y * wy, times_z * wz,
                           90.0, 90.0, 90.0)
 
-    # Save and clean up
+    # Save
     atomsel('all', molid=output_id).write('mae', merge_output_filename)
-
-    for tile_filename in tile_filenames:
-        os.remove(tile_filename)
     return output_id
 
 #==========================================================================
@@ -495,6 +683,7 @@ def combine_molecules(input_ids, tmp_dir):
     molecule.set_top(output_id)
     for i in input_ids:
         molecule.delete(i)
+    _cached_atomsel.cache_clear()
     atomsel('all', molid=output_id).beta = 1
     return output_id
 
@@ -514,7 +703,9 @@ def atomsel_remaining(molid, sel):
       if no atoms matched the selection
     """
 
-    selection = atomsel('beta 1 and (%s)' % sel, molid)
+    # Reuse the parsed selection, re-evaluating it as beta may have changed
+    selection = _cached_atomsel(molid, sel)
+    selection.update()
     #if len(selection) == 0:
     #    return None
     #else:
@@ -522,6 +713,23 @@ def atomsel_remaining(molid, sel):
 
 #==========================================================================
 
+@lru_cache(maxsize=256)
+def _cached_atomsel(molid, sel):
+    """
+    Parses a remaining atom selection once per molecule and selection
+    string. Cleared whenever molecules are replaced.
+
+    Args:
+      molid (int): VMD molecule id to consider
+      sel (str): VMD atom selection string to grab
+
+    Returns:
+      VMD atomsel object representing the selection
+    """
+    return atomsel('beta 1 and (%s)' % sel, molid)
+
+#==========================================================================
+
 def num_atoms_remaining(molid, sel='all'):
     """
     Returns the number of atoms remaining in the system, indicated
@@ -440,11 +440,9 @@ class AmberWriter(MoleculeWriter):
             idx (int): Current atom index
             hetatom (bool): Whether or not this is a heteroatom
         """
-        for i in ressel.index:
-            a = atomsel('index %d' % i) # pylint: disable=invalid-name
-            fileh.write(self.get_pdb_line(a, idx, a.resid[0], hetatom=hetatom))
-            idx += 1
-        return idx
+        fileh.write(self.get_pdb_lines(ressel, idx, ressel.resid,
+                                       hetatom=hetatom))
+        return idx + len(ressel)
 
     #==========================================================================
 
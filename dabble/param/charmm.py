@@ -868,10 +868,10 @@ def _write_ordered_pdb(filename, sel, molid):
         residues = sorted(set(atomsel("resid '%s' and residue %s"
                                       % (resid, resstr)).residue))
         for rid in residues:
-            for i in atomsel('residue %d' % rid).index:
-                a = atomsel('index %d' % i) # pylint: disable=invalid-name
-                fileh.write(MoleculeWriter.get_pdb_line(a, idx, a.resid[0]))
-                idx += 1
+            ressel = atomsel('residue %d' % rid)
+            fileh.write(MoleculeWriter.get_pdb_lines(ressel, idx,
+                                                     ressel.resid))
+            idx += len(ressel)
     fileh.write('END\n')
     atomsel(sel).user = 0.0
     fileh.close()
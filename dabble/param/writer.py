@@ -29,6 +29,7 @@ import logging
 import tempfile
 
 from abc import ABC, abstractmethod
+from numbers import Integral
 from dabble import DabbleError
 from pkg_resources import resource_filename
 from vmd import atomsel
@@ -292,11 +293,8 @@ class MoleculeWriter(ABC):
         with os.fdopen(f, 'w') as fileh:
             for ridx, residue in enumerate(residues):
                 res = atomsel('residue %d' % residue, molid=molid)
-
-                for i in res.index:
-                    a = atomsel('index %d' % i, molid)
-                    fileh.write(self.get_pdb_line(a, idx, ridx+1))
-                    idx += 1
+                fileh.write(self.get_pdb_lines(res, idx, ridx+1))
+                idx += len(res)
 
             fileh.write('END\n')
         return temp
@@ -373,21 +371,43 @@ class MoleculeWriter(ABC):
         if len(atom) != 1:
             raise ValueError("PDB entry selection must be only one atom")
 
-        ins = atom.insertion[0]
-        result = "%-6s%5d %-5s%-4s%c%4d%c  %8.3f%8.3f%8.3f%6.2f%6.2f" \
-                 "     %-4s%2s\n" % ("HETATM" if hetatom else "ATOM",
-                                     index,
-                                     atom.name[0],
-                                     atom.resname[0],
-                                     atom.chain[0],
-                                     resindex,
-                                     ins if ins else " ",
-                                     atom.x[0],
-                                     atom.y[0],
-                                     atom.z[0],
-                                     0.0, 0.0,
-                                     atom.segname[0],
-                                     atom.element[0])
+        return MoleculeWriter.get_pdb_lines(atom, index, resindex,
+                                            hetatom=hetatom)
+
+    #==========================================================================
+
+    @staticmethod
+    def get_pdb_lines(sel, start_index, resindex, hetatom=False):
+        """
+        Get the PDB-formatted lines corresponding to all atoms in a
+        selection, in index order, with a newline at the end of each.
+        Atom attributes are fetched from VMD once for the whole selection.
+
+        Args:
+            sel (VMD atomsel): Atoms selected
+            start_index (int): Index in PDB file of the first atom.
+                Following atoms are numbered consecutively
+            resindex (int or list of int): Residue number in PDB file,
+                either for all atoms or for each atom
+            hetatom (bool): If this is part of a non-standard residue
+
+        Returns:
+            (str) PDB file lines for these atoms
+        """
+        if isinstance(resindex, Integral):
+            resindex = [resindex] * len(sel)
+
+        record = "HETATM" if hetatom else "ATOM"
+        result = "".join(
+            "%-6s%5d %-5s%-4s%c%4d%c  %8.3f%8.3f%8.3f%6.2f%6.2f"
+            "     %-4s%2s\n" % (record, index, name, resname, chain, resid,
+                               ins if ins else " ", x, y, z, 0.0, 0.0,
+                               segname, element)
+            for index, name, resname, chain, resid, ins, x, y, z, segname,
+                element in zip(range(start_index, start_index + len(sel)),
+                               sel.name, sel.resname, sel.chain, resindex,
+                               sel.insertion, sel.x, sel.y, sel.z,
+                               sel.segname, sel.element))
         return result
 
     #==========================================================================
@@ -0,0 +1,62 @@
+"""
+Tests diameter calculation against a brute force search
+"""
+import numpy as np
+import pytest
+
+#==============================================================================
+
+def brute_diameter(coords):
+    """
+    Largest distance between any two points, checking every pair
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    diff = coords[:, None, :] - coords[None, :, :]
+    return np.sqrt((diff**2).sum(axis=-1).max())
+
+#==============================================================================
+
+@pytest.mark.parametrize("num", [2, 3, 4, 10, 500])
+def test_diameter_random(num):
+    """
+    Tests diameter of random points, near and far from the origin
+    """
+    from dabble.molutils import diameter
+
+    rng = np.random.RandomState(num)
+    for offset in [0.0, 1e4]:
+        coords = rng.normal(scale=30.0, size=(num, 2)) + offset
+        coords = coords.astype(np.float32)
+        assert diameter(coords) == pytest.approx(brute_diameter(coords),
+                                                 rel=1e-5)
+
+#==============================================================================
+
+def test_diameter_chunked():
+    """
+    Tests diameter when the distances are computed in several chunks
+    """
+    from dabble.molutils import diameter
+
+    rng = np.random.RandomState(0)
+    for dim in [2, 3]:
+        coords = rng.normal(size=(300, dim)).astype(np.float32)
+        assert diameter(coords, chunkmem=5000) == \
+                pytest.approx(brute_diameter(coords), rel=1e-5)
+
+#==============================================================================
+
+def test_diameter_degenerate():
+    """
+    Tests diameter of collinear, duplicated and identical points
+    """
+    from dabble.molutils import diameter
+
+    collinear = [[0, 0], [1, 1], [2, 2], [3, 3], [3, 3], [0, 0]]
+    assert diameter(collinear) == pytest.approx(np.sqrt(18.0))
+
+    assert diameter(np.ones((10, 2))) == pytest.approx(0.0)
+    assert diameter(np.ones((1, 2))) == pytest.approx(0.0)
+    assert diameter(np.zeros((0, 2))) == 0
+
+#==============================================================================